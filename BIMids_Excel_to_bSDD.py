@@ -1,10 +1,214 @@
 import pandas as pd
 import os
 import json
+import hashlib
+import inspect
+import io
+import zipfile
+import xml.etree.ElementTree as ET
 from datetime import datetime
 
+# Parsed sheets are cached as Parquet files, one per sheet, so repeated exports skip the slow xlsx parsing.
+# The manifest records which workbook hash and sheet fingerprint each cached sheet was parsed from;
+# a sheet is re-parsed the first time it is read after its own contents change.
+SHEET_CACHE_DIR = os.path.join('temp', 'sheet_cache')
+SHEET_CACHE_MANIFEST = os.path.join(SHEET_CACHE_DIR, 'manifest.json')
+
+# Delta exports record which sheet fingerprint each class was generated from, per output file
+SOURCE_MANIFEST_DIR = os.path.join('temp', 'bsdd_sources')
+# Bump when class output changes in a way the hashed generator source below does not capture
+GENERATOR_VERSION = 1
+
+XLSX_NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+}
+XLSX_CELL = f"{{{XLSX_NS['main']}}}c"
+XLSX_ROW = f"{{{XLSX_NS['main']}}}row"
+
+_file_hashes = {}
+_open_workbooks = {}
+_sheet_fingerprints = {}
+
+def file_hash(path):
+    full_path = os.path.abspath(path)
+    stat = os.stat(full_path)
+    key = (full_path, stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(full_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+def sheet_fingerprints(excel_file):
+    # Hash each worksheet straight from the xlsx archive, without parsing any cells. Shared strings
+    # are hashed by the values a sheet references, so adding text to one sheet leaves the others alone.
+    # Styles and the workbook properties (date1904) change how cells are read, so they go into every sheet.
+    full_path = os.path.abspath(excel_file)
+    wb_hash = file_hash(full_path)
+    if wb_hash in _sheet_fingerprints:
+        return _sheet_fingerprints[wb_hash]
+
+    with zipfile.ZipFile(full_path) as archive:
+        names = set(archive.namelist())
+        rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        targets = {rel.get('Id'): rel.get('Target') for rel in rels.findall('rel:Relationship', XLSX_NS)}
+
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in names:
+            strings_root = ET.fromstring(archive.read('xl/sharedStrings.xml'))
+            for si in strings_root.findall('main:si', XLSX_NS):
+                shared_strings.append(''.join(t.text or '' for t in si.iter(f"{{{XLSX_NS['main']}}}t")))
+
+        workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+        shared_digest = hashlib.sha256()
+        if 'xl/styles.xml' in names:
+            shared_digest.update(archive.read('xl/styles.xml'))
+        workbook_pr = workbook.find('main:workbookPr', XLSX_NS)
+        if workbook_pr is not None:
+            shared_digest.update(json.dumps(sorted(workbook_pr.attrib.items())).encode('utf-8'))
+
+        fingerprints = {}
+        for sheet in workbook.findall('main:sheets/main:sheet', XLSX_NS):
+            target = targets[sheet.get(f"{{{XLSX_NS['r']}}}id")]
+            part = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+            data = archive.read(part)
+            digest = hashlib.sha256(shared_digest.digest())
+            digest.update(data)
+            # Match cells by namespace rather than by markup, as some writers use prefixed tags like <x:c>
+            for _, elem in ET.iterparse(io.BytesIO(data)):
+                if elem.tag == XLSX_CELL and elem.get('t') == 's':
+                    value = elem.find('main:v', XLSX_NS)
+                    if value is not None and value.text is not None:
+                        digest.update(b'\x1f' + shared_strings[int(value.text)].encode('utf-8'))
+                elif elem.tag == XLSX_ROW:
+                    elem.clear()
+            fingerprints[sheet.get('name')] = digest.hexdigest()
+
+    _sheet_fingerprints[wb_hash] = fingerprints
+    return fingerprints
+
+def write_json_atomic(path, obj):
+    # Write next to the target and swap it in, so an interrupted write never leaves a truncated file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def load_json_or_empty(path):
+    # Cache files are disposable: an unreadable one is treated as empty instead of failing the export
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache file {path}: {str(e)}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def load_sheet_cache_manifest():
+    return load_json_or_empty(SHEET_CACHE_MANIFEST)
+
+def save_sheet_cache_manifest(manifest):
+    try:
+        write_json_atomic(SHEET_CACHE_MANIFEST, manifest)
+    except OSError as e:
+        print(f"Could not update sheet cache manifest: {str(e)}")
+
+def sheet_cache_path(full_path, sheet_name):
+    # Sheet names can contain characters that are not valid in file names, so key the file on a hash
+    name_hash = hashlib.sha256(f"{full_path}|{sheet_name}".encode('utf-8')).hexdigest()[:16]
+    safe_name = ''.join(c if c.isalnum() else '_' for c in sheet_name)
+    return os.path.join(SHEET_CACHE_DIR, f"{safe_name}_{name_hash}.parquet")
+
+def to_columnar(df):
+    # Parquet columns need a single type, so columns mixing e.g. numbers and text are stored as text,
+    # which is how the export treats those cells anyway.
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and df[col].dropna().map(type).nunique() > 1:
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    df.columns = [str(col) for col in df.columns]
+    return df
+
+def from_columnar(df):
+    df.columns = [int(col) for col in df.columns]
+    return df
+
+def close_open_workbooks():
+    # Release the xlsx file handle so the workbook can be saved in Excel between exports
+    for workbook in _open_workbooks.values():
+        workbook.close()
+    _open_workbooks.clear()
+
+def read_cached_sheet(cache_path):
+    try:
+        return from_columnar(pd.read_parquet(cache_path))
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cached sheet {cache_path}: {str(e)}")
+        return None
+
+def write_cached_sheet(df, cache_path):
+    tmp_path = f"{cache_path}.tmp"
+    to_columnar(df).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+
+def read_sheet(excel_file, sheet_name):
+    full_path = os.path.abspath(excel_file)
+    wb_hash = file_hash(full_path)
+    cache_path = sheet_cache_path(full_path, sheet_name)
+
+    if not os.path.exists(SHEET_CACHE_DIR):
+        os.makedirs(SHEET_CACHE_DIR)
+
+    manifest = load_sheet_cache_manifest()
+    entry = manifest.get(full_path, {}).get(sheet_name)
+    if isinstance(entry, dict) and os.path.exists(cache_path):
+        if entry.get('workbook_hash') == wb_hash:
+            df = read_cached_sheet(cache_path)
+            if df is not None:
+                return df
+        else:
+            # The workbook changed, but maybe not this sheet
+            sheet_hash = sheet_fingerprints(full_path).get(sheet_name)
+            if sheet_hash is not None and entry.get('sheet_hash') == sheet_hash:
+                df = read_cached_sheet(cache_path)
+                if df is not None:
+                    entry['workbook_hash'] = wb_hash
+                    save_sheet_cache_manifest(manifest)
+                    return df
+
+    # Open the workbook once per export instead of once per sheet; excel_to_bsdd_json closes it when done
+    workbook_key = (full_path, wb_hash)
+    if workbook_key not in _open_workbooks:
+        close_open_workbooks()
+        _open_workbooks[workbook_key] = pd.ExcelFile(full_path)
+    df = _open_workbooks[workbook_key].parse(sheet_name=sheet_name, header=None)
+
+    try:
+        write_cached_sheet(df, cache_path)
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Could not cache sheet {sheet_name}: {str(e)}")
+        return from_columnar(to_columnar(df))
+
+    if not isinstance(manifest.get(full_path), dict):
+        manifest[full_path] = {}
+    manifest[full_path][sheet_name] = {
+        'workbook_hash': wb_hash,
+        'sheet_hash': sheet_fingerprints(full_path).get(sheet_name),
+        'file': os.path.basename(cache_path)
+    }
+    save_sheet_cache_manifest(manifest)
+    # Read back from the cache so a fresh parse and a cache hit give identical frames
+    df_cached = read_cached_sheet(cache_path)
+    return df_cached if df_cached is not None else from_columnar(to_columnar(df))
+
 def process_class_properties(excel_file, sheet_name, class_name, ifc_class, dic_ver):
-    df = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
+    df = read_sheet(excel_file, sheet_name)
     properties = []
     property_section = False
     excluded_properties = ['Object name', 'IFC Type', 'IFC Object Type', 'Classification', 'Numerical identifier', 'PROPERTY']
@@ -73,17 +277,147 @@ def process_class_properties(excel_file, sheet_name, class_name, ifc_class, dic_
 
     return properties, definition
 
-def excel_to_bsdd_json(excel_file):
+def load_previous_output(previous_output):
+    # Index the previous dictionary by class and property Code. Raises OSError, ValueError, KeyError
+    # or TypeError if the file cannot be used, so the caller can fall back to a full export.
+    with open(previous_output, 'r', encoding='utf-8') as f:
+        previous_json = json.load(f)
+    if not isinstance(previous_json, dict):
+        raise ValueError("expected a bSDD dictionary object")
+    previous_classes = {class_obj['Code']: class_obj for class_obj in previous_json.get('Classes', [])}
+    previous_properties = {prop['Code']: prop for prop in previous_json.get('Properties', [])}
+    # The change set indexes ClassProperties by Code as well
+    for code, class_obj in previous_classes.items():
+        if any('Code' not in prop for prop in class_obj.get('ClassProperties', [])):
+            raise KeyError(f"ClassProperty without Code in class {code}")
+    return previous_json, previous_classes, previous_properties
+
+def source_manifest_path(output_file):
+    return os.path.join(SOURCE_MANIFEST_DIR, f"{os.path.basename(output_file)}.json")
+
+def generator_hash():
+    # Reused classes must come from the same generator code, so hash the code that shapes a class sheet
+    try:
+        sources = [inspect.getsource(func) for func in (process_class_properties, to_columnar, from_columnar)]
+    except (OSError, TypeError):
+        print("Generator source is not available, classes will not be reused from a previous output")
+        return None
+    return hashlib.sha256(json.dumps([GENERATOR_VERSION] + sources).encode('utf-8')).hexdigest()
+
+def load_source_manifest(output_file, generator):
+    # Only trust the recorded sources if the output is still the file they were recorded for,
+    # written by the same generator
+    path = source_manifest_path(output_file)
+    if generator is None or not os.path.exists(output_file):
+        return {}
+    manifest = load_json_or_empty(path)
+    if manifest.get('output_hash') != file_hash(output_file) or manifest.get('generator') != generator:
+        return {}
+    classes = manifest.get('classes', {})
+    return classes if isinstance(classes, dict) else {}
+
+def save_source_manifest(output_file, class_sources, generator):
+    try:
+        if not os.path.exists(SOURCE_MANIFEST_DIR):
+            os.makedirs(SOURCE_MANIFEST_DIR)
+        manifest = {
+            'output_hash': file_hash(output_file),
+            'generator': generator,
+            'classes': class_sources
+        }
+        write_json_atomic(source_manifest_path(output_file), manifest)
+    except OSError as e:
+        print(f"Could not update source manifest: {str(e)}")
+
+def class_source_key(sheet_hash, sheet_name, ifc_class, dic_ver, generator):
+    # Everything process_class_properties depends on
+    return hashlib.sha256(json.dumps([sheet_hash, sheet_name, ifc_class, dic_ver, generator]).encode('utf-8')).hexdigest()
+
+def canonical(obj):
+    return json.dumps(obj, sort_keys=True)
+
+def diff_by_code(previous_by_code, current_items, key=canonical):
+    current_by_code = {item['Code']: item for item in current_items}
+    return {
+        'Added': [item for code, item in current_by_code.items() if code not in previous_by_code],
+        'Removed': [code for code in previous_by_code if code not in current_by_code],
+        'Modified': [item for code, item in current_by_code.items()
+                     if code in previous_by_code and key(item) != key(previous_by_code[code])]
+    }
+
+def without_class_properties(class_obj):
+    return {k: v for k, v in class_obj.items() if k != 'ClassProperties'}
+
+def build_change_set(previous_json, previous_classes, previous_properties, bsdd_json):
+    header_fields = [k for k in bsdd_json if k not in ('ReleaseDate', 'Classes', 'Properties')]
+    dictionary_changes = {k: bsdd_json[k] for k in header_fields if previous_json.get(k) != bsdd_json[k]}
+
+    # Class-level fields and ClassProperties are reported separately, so a changed property
+    # does not republish the whole class
+    class_changes = diff_by_code(previous_classes, bsdd_json['Classes'], lambda c: canonical(without_class_properties(c)))
+    class_changes['Modified'] = [without_class_properties(c) for c in class_changes['Modified']]
+
+    class_property_changes = {}
+    for class_obj in bsdd_json['Classes']:
+        previous_class = previous_classes.get(class_obj['Code'])
+        if previous_class is None:
+            continue
+        previous_class_properties = {prop['Code']: prop for prop in previous_class.get('ClassProperties', [])}
+        changes = diff_by_code(previous_class_properties, class_obj.get('ClassProperties', []))
+        if any(changes.values()):
+            class_property_changes[class_obj['Code']] = changes
+
+    return {
+        'DictionaryVersion': bsdd_json['DictionaryVersion'],
+        'PreviousDictionaryVersion': previous_json.get('DictionaryVersion'),
+        'Dictionary': dictionary_changes,
+        'Classes': class_changes,
+        'Properties': diff_by_code(previous_properties, bsdd_json['Properties']),
+        'ClassProperties': class_property_changes
+    }
+
+def change_set_is_empty(change_set):
+    return (not change_set['Dictionary'] and not change_set['ClassProperties']
+            and not any(change_set['Classes'].values()) and not any(change_set['Properties'].values()))
+
+def excel_to_bsdd_json(excel_file, previous_output=None):
     try:
         full_path = os.path.abspath(excel_file)
         print(f"Attempting to open file: {full_path}")
 
-        props_df = pd.read_excel(full_path, sheet_name='Property definitions', header=None)
-        classes_df = pd.read_excel(full_path, sheet_name='IFC mapping', header=None)
+        props_df = read_sheet(full_path, 'Property definitions')
+        classes_df = read_sheet(full_path, 'IFC mapping')
         
         used_class_codes = []
         used_property_codes = []
         dic_ver = "0.3"
+        output_file = 'bsdd_output.json'
+        changes_file = 'bsdd_changes.json'
+
+        # In delta mode, classes whose source sheet did not change are copied from the previous output
+        previous_json = None
+        previous_classes = {}
+        previous_properties = {}
+        previous_sources = {}
+        generator = generator_hash()
+        if previous_output is not None:
+            if os.path.exists(previous_output):
+                try:
+                    previous_json, previous_classes, previous_properties = load_previous_output(previous_output)
+                    previous_sources = load_source_manifest(previous_output, generator)
+                    print(f"Delta export against {previous_output}")
+                except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                    print(f"Previous output {previous_output} could not be read ({str(e)}), doing a full export")
+                    previous_json = None
+                    previous_classes = {}
+                    previous_properties = {}
+                    previous_sources = {}
+            else:
+                print(f"Previous output {previous_output} not found, doing a full export")
+
+        fingerprints = sheet_fingerprints(full_path)
+        class_sources = {}
+        reused_classes = 0
 
         bsdd_json = {
             "OrganizationCode": "bw",
@@ -151,28 +485,62 @@ def excel_to_bsdd_json(excel_file):
                         }
 
                     # Process properties for this class
-                    try:
-                        class_properties, definition = process_class_properties(full_path, sheet_name, ifc_class, code, dic_ver)
-                        class_obj["ClassProperties"] = class_properties
-                        class_obj["Definition"] = definition
-                    except Exception as e:
-                        print(f"Error processing properties for {class_name}: {str(e)}")
+                    source_key = class_source_key(fingerprints.get(sheet_name), sheet_name, ifc_class, dic_ver, generator)
+                    previous_class = previous_classes.get(code)
+                    if sheet_name not in fingerprints:
+                        # Known from the archive listing, so there is no need to open the workbook to find out
+                        print(f"Error processing properties for {class_name}: Worksheet named '{sheet_name}' not found")
+                    elif previous_class is not None and previous_sources.get(code) == source_key:
+                        class_obj["ClassProperties"] = previous_class["ClassProperties"]
+                        class_obj["Definition"] = previous_class["Definition"]
+                        class_sources[code] = source_key
+                        reused_classes += 1
+                    else:
+                        try:
+                            class_properties, definition = process_class_properties(full_path, sheet_name, ifc_class, code, dic_ver)
+                            class_obj["ClassProperties"] = class_properties
+                            class_obj["Definition"] = definition
+                            class_sources[code] = source_key
+                        except Exception as e:
+                            print(f"Error processing properties for {class_name}: {str(e)}")
 
                     bsdd_json['Classes'].append(class_obj)
                     used_class_codes.append(code)
 
-        output_file = 'bsdd_output.json'
+        change_set = None
+        if previous_json is not None:
+            print(f"Reused {reused_classes} of {len(bsdd_json['Classes'])} classes from {previous_output}")
+            change_set = build_change_set(previous_json, previous_classes, previous_properties, bsdd_json)
+            # Nothing changed, so this is still the previous release
+            if change_set_is_empty(change_set) and 'ReleaseDate' in previous_json:
+                bsdd_json['ReleaseDate'] = previous_json['ReleaseDate']
+            change_set['ReleaseDate'] = bsdd_json['ReleaseDate']
+
         with open(output_file, 'w') as f:
             json.dump(bsdd_json, f, indent=2)
+        save_source_manifest(output_file, class_sources, generator)
 
         print(f"bSDD JSON file has been generated: {output_file}")
 
+        if change_set is not None:
+            with open(changes_file, 'w') as f:
+                json.dump(change_set, f, indent=2)
+            print(f"Change set has been generated: {changes_file} "
+                  f"({len(change_set['Classes']['Added'])} classes added, "
+                  f"{len(change_set['Classes']['Removed'])} removed, "
+                  f"{len(change_set['Classes']['Modified'])} modified; "
+                  f"ClassProperties changed in {len(change_set['ClassProperties'])} classes)")
+
     except Exception as e:
         print(f"An error occurred: {str(e)}")
+    finally:
+        close_open_workbooks()
 
 # Usage
 excel_file = '240912_EIR_AR-MEP-ST_multiple use-cases_HDWI.xlsx'
 excel_to_bsdd_json(excel_file)
+# Delta export: only regenerates classes whose sheets changed and also writes bsdd_changes.json
+#excel_to_bsdd_json(excel_file, previous_output='bsdd_output.json')
 
 
 # BASE_URL = "https://api.bsdd.buildingsmart.org"
@@ -1,9 +1,72 @@
 import os
 import xml.etree.ElementTree as ET
 import json
-from collections import defaultdict
+from collections import defaultdict, deque
 import lxml.etree as lxml_ET
 
+# Tree traversal helpers. All tree stages walk their trees through these explicit-stack
+# generators instead of recursing, so deep classifications never hit the recursion limit.
+# Walkers yield (node, parent, depth) tuples lazily; parent is None for the roots.
+_DONE = object()
+
+def node_children(node):
+    return node['children']
+
+def item_children(element):
+    children = element.find('Children')
+    if children is None:
+        return []
+    return [child for child in children if child.tag == 'Item']
+
+def iter_preorder(roots, children=node_children):
+    # Children are fetched only after the parent has been handled, so callers may
+    # update a node's children while visiting it and the walk will see the changes.
+    stack = [(node, None, 0) for node in reversed(list(roots))]
+    while stack:
+        node, parent, depth = stack.pop()
+        yield node, parent, depth
+        stack.extend((child, node, depth + 1) for child in reversed(list(children(node))))
+
+def iter_postorder(roots, children=node_children):
+    stack = [(node, None, 0, False) for node in reversed(list(roots))]
+    while stack:
+        node, parent, depth, expanded = stack.pop()
+        if expanded:
+            yield node, parent, depth
+            continue
+        stack.append((node, parent, depth, True))
+        stack.extend((child, node, depth + 1, False) for child in reversed(list(children(node))))
+
+def iter_levelorder(roots, children=node_children):
+    queue = deque((node, None, 0) for node in roots)
+    while queue:
+        node, parent, depth = queue.popleft()
+        yield node, parent, depth
+        queue.extend((child, node, depth + 1) for child in children(node))
+
+def fold_tree(roots, children, visit):
+    # Bottom-up rebuild of a tree: visit(node, parent, child_results) is called once all
+    # of a node's children have been visited. Returns the results for the roots, in order.
+    results = []
+    stack = [(None, None, iter(roots), results)]
+    while stack:
+        node, parent, pending, collected = stack[-1]
+        child = next(pending, _DONE)
+        if child is _DONE:
+            stack.pop()
+            if stack:
+                stack[-1][3].append(visit(node, parent, collected))
+            continue
+        stack.append((child, node, iter(children(child)), []))
+    return results
+
+def container_children(obj):
+    if isinstance(obj, dict):
+        return list(obj.values())
+    if isinstance(obj, list):
+        return obj
+    return ()
+
 def detect_language(root):
     # Check for a French property
     french_properties = get_properties_to_delete("French")
@@ -26,42 +89,21 @@ def remove_properties_from_tree(root, properties_to_delete):
             elem.getparent().remove(elem)
 
 def build_element_tree(root):
-    def recursive_build(element):
-        if element.tag != 'Item':
-            return None
-        
-        item_id = element.find('ID').text
-        name = element.find('Name').text
-        
-        children = []
-        for child in element.find('Children') or []:
-            child_tree = recursive_build(child)
-            if child_tree:
-                children.append(child_tree)
-        
+    def build_node(element, parent, children):
         return {
-            'id': item_id,
+            'id': element.find('ID').text,
             'children': children,
             'properties': set()
         }
 
-    tree = []
-    for item in root.find('.//Items'):
-        item_tree = recursive_build(item)
-        if item_tree:
-            tree.append(item_tree)
-    
-    return tree
+    items = [item for item in root.find('.//Items') if item.tag == 'Item']
+    return fold_tree(items, item_children, build_node)
 
 def get_properties(root, element_tree):
-    def find_node(tree, item_id):
-        for node in tree:
-            if node['id'] == item_id:
-                return node
-            result = find_node(node['children'], item_id)
-            if result:
-                return result
-        return None
+    # First match in pre-order wins, as with a depth-first search
+    node_index = {}
+    for node, _, _ in iter_preorder(element_tree):
+        node_index.setdefault(node['id'], node)
 
     for prop_def in root.findall('.//PropertyDefinition'):
         name_elem = prop_def.find('Name')
@@ -70,7 +112,7 @@ def get_properties(root, element_tree):
             for class_id in prop_def.findall('.//ClassificationID/ItemID'):
                 if class_id is not None:
                     item_id = class_id.text
-                    node = find_node(element_tree, item_id)
+                    node = node_index.get(item_id)
                     if node:
                         node['properties'].add(prop_name)
                         #print(f"Added property '{prop_name}' to node '{item_id}'")
@@ -78,10 +120,8 @@ def get_properties(root, element_tree):
     return element_tree
 
 def assign_properties(tree):
-    def recursive_assign(node, parent_properties=None):
-        if parent_properties is None:
-            parent_properties = set()
-
+    # Pre-order: a node's children are updated before they are visited themselves
+    for node, _, _ in iter_preorder(tree):
         children_with_properties = [child for child in node['children'] if child['properties']]
         children_with_children = [child for child in node['children'] if child['children']]
         overlap = [child for child in children_with_properties if child in children_with_children]
@@ -108,13 +148,6 @@ def assign_properties(tree):
                     child['properties'] = set(node['properties'])
 
         #print(f"Final properties for {node['id']}: {node['properties']}")
-
-        # Recursively process children
-        for child in node['children']:
-            recursive_assign(child, node['properties'])
-
-    for node in tree:
-        recursive_assign(node)
     
     return tree
 
@@ -136,21 +169,24 @@ def handle_covering_case(node):
                 child['properties'] = common_properties
 
 
+# Function to convert sets to lists for JSON serialization
 def sets_to_lists(obj):
-    if isinstance(obj, dict):
-        return {k: sets_to_lists(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [sets_to_lists(v) for v in obj]
-    elif isinstance(obj, set):
-        return list(obj)
-    else:
-        return obj
+    def convert(value, parent, converted):
+        if isinstance(value, dict):
+            return dict(zip(value.keys(), converted))
+        elif isinstance(value, list):
+            return converted
+        elif isinstance(value, set):
+            return list(value)
+        else:
+            return value
+
+    return fold_tree([obj], container_children, convert)[0]
     
     
 def export_config_prev(element_tree):
-    def recursive_export(node, parent_properties=None):
-        if parent_properties is None:
-            parent_properties = set()
+    def export_node(node, parent, child_configs):
+        parent_properties = parent['properties'] if parent is not None else set()
 
         config_node = {
             'id': node['id']
@@ -164,12 +200,7 @@ def export_config_prev(element_tree):
         if new_props and node['properties'] != parent_properties:
             config_node['new_properties'] = new_props
 
-        children = []
-        for child in node['children']:
-            child_config = recursive_export(child, node['properties'])
-            if child_config:
-                children.append(child_config)
-
+        children = [child_config for child_config in child_configs if child_config]
         if children:
             config_node['children'] = children
 
@@ -180,54 +211,36 @@ def export_config_prev(element_tree):
 
         return config_node if len(config_node) > 1 else None
 
-    config_prev = []
-    for root_node in element_tree:
-        root_config = recursive_export(root_node)
-        if root_config:
-            config_prev.append(root_config)
-
-    return config_prev
+    config_prev = fold_tree(element_tree, node_children, export_node)
+    return [root_config for root_config in config_prev if root_config]
 
 def clean_and_convert(obj):
-    if isinstance(obj, dict):
-        return {k: clean_and_convert(v) for k, v in obj.items() if v}
-    elif isinstance(obj, list):
-        return [clean_and_convert(v) for v in obj if v]
-    elif isinstance(obj, set):
-        return list(obj) if obj else None
-    else:
-        return obj
-    
-# Function to convert sets to lists for JSON serialization
-def sets_to_lists(obj):
-    if isinstance(obj, dict):
-        return {k: sets_to_lists(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [sets_to_lists(v) for v in obj]
-    elif isinstance(obj, set):
-        return list(obj)
-    else:
-        return obj
+    def non_empty_children(value):
+        return [v for v in container_children(value) if v]
+
+    def convert(value, parent, converted):
+        if isinstance(value, dict):
+            return dict(zip([k for k, v in value.items() if v], converted))
+        elif isinstance(value, list):
+            return converted
+        elif isinstance(value, set):
+            return list(value) if value else None
+        else:
+            return value
+
+    return fold_tree([obj], non_empty_children, convert)[0]
     
 
 def apply_new_config(element_tree, new_config):
-    def find_config_node(config, node_id):
-        for item in config:
-            if item['id'] == node_id:
-                return item
-            if 'children' in item:
-                result = find_config_node(item['children'], node_id)
-                if result:
-                    return result
-        return None
-
-    def process_node(node, parent_properties=None):
-        if parent_properties is None:
-            parent_properties = set()
+    # First match in pre-order wins, as with a depth-first search
+    config_index = {}
+    for item, _, _ in iter_preorder(new_config, lambda item: item.get('children', [])):
+        config_index.setdefault(item['id'], item)
 
-        config_node = find_config_node(new_config, node['id'])
+    for node, parent, _ in iter_preorder(element_tree):
+        config_node = config_index.get(node['id'])
 
-        node['properties'] = set(parent_properties)
+        node['properties'] = set(parent['properties']) if parent is not None else set()
 
         if config_node:
             if 'not_inherited_from' in config_node:
@@ -235,15 +248,13 @@ def apply_new_config(element_tree, new_config):
             if 'new_properties' in config_node:
                 node['properties'] |= set(config_node['new_properties'])
 
-        for child in node['children']:
-            process_node(child, node['properties'])
-
+    # Children inherit first, then lose what their parent never passes on
+    for node, _, _ in iter_postorder(element_tree):
+        config_node = config_index.get(node['id'])
         if config_node and 'never_inherit_to' in config_node:
             for child in node['children']:
                 child['properties'] -= set(config_node['never_inherit_to'])
 
-    for root_node in element_tree:
-        process_node(root_node)
 
 
 def process_xml_file(input_path, output_path):
@@ -279,14 +290,7 @@ def update_xml_properties(root, element_tree, language):
         return element_tree
 
     # Create a mapping of element IDs to their nodes in the element_tree
-    element_map = {}
-    def build_element_map(node):
-        element_map[node['id']] = node
-        for child in node['children']:
-            build_element_map(child)
-
-    for root_node in element_tree:
-        build_element_map(root_node)
+    element_map = {node['id']: node for node, _, _ in iter_preorder(element_tree)}
 
     #print("Element map after building:")
     #for element_id, node in element_map.items():
@@ -352,29 +356,14 @@ def xml_to_json(folder, is_input=True):
     if not os.path.exists(json_folder):
         os.makedirs(json_folder)
 
-    def parse_element(element):
-        result = {
-            'id': element.find('ID').text if element.find('ID') is not None else None,
-            'properties': [],
-            'children': []
+    def parse_element(element, parent, children):
+        item_id = element.find('ID').text if element.find('ID') is not None else None
+        return {
+            'id': item_id,
+            'properties': list(properties_by_id.get(item_id, [])),
+            'children': children
         }
 
-        # Get properties
-        for prop_def in root.findall('.//PropertyDefinition'):
-            prop_name = prop_def.find('Name').text
-            class_ids = [class_id.find('ItemID').text for class_id in prop_def.findall('.//ClassificationID')]
-            if result['id'] in class_ids:
-                result['properties'].append(prop_name)
-
-        # Process children
-        children = element.find('Children')
-        if children is not None:
-            for child in children:
-                if child.tag == 'Item':
-                    result['children'].append(parse_element(child))
-
-        return result
-
     for filename in os.listdir(folder):
         if filename.endswith('.xml'):
             input_path = os.path.join(folder, filename)
@@ -389,10 +378,15 @@ def xml_to_json(folder, is_input=True):
                 print(f"Warning: No Items found in {filename}")
                 continue
 
-            result = []
-            for item in items:
-                if item.tag == 'Item':
-                    result.append(parse_element(item))
+            # Get properties per item ID once, in PropertyDefinition order
+            properties_by_id = defaultdict(list)
+            for prop_def in root.findall('.//PropertyDefinition'):
+                prop_name = prop_def.find('Name').text
+                class_ids = [class_id.find('ItemID').text for class_id in prop_def.findall('.//ClassificationID')]
+                for item_id in dict.fromkeys(class_ids):
+                    properties_by_id[item_id].append(prop_name)
+
+            result = fold_tree([item for item in items if item.tag == 'Item'], item_children, parse_element)
 
             with open(output_path, 'w', encoding='utf-8') as f:
                 json.dump(result, f, ensure_ascii=False, indent=2)
@@ -406,14 +400,14 @@ def element_tree_to_json(element_tree, filename):
     if not os.path.exists(json_folder):
         os.makedirs(json_folder)
 
-    def convert_node(node):
+    def convert_node(node, parent, children):
         return {
             'id': node['id'],
             'properties': list(node['properties']),
-            'children': [convert_node(child) for child in node['children']]
+            'children': children
         }
 
-    result = [convert_node(root_node) for root_node in element_tree]
+    result = fold_tree(element_tree, node_children, convert_node)
 
     output_filename = f"element_tree_{os.path.splitext(filename)[0]}.json"
     output_path = os.path.join(json_folder, output_filename)
@@ -424,9 +418,8 @@ def element_tree_to_json(element_tree, filename):
     print(f"Element tree JSON saved to {output_path}")
 
 def print_element_tree(element_tree, indent=""):
-    for node in element_tree:
-        print(f"{indent}{node['id']}: {node['properties']}")
-        print_element_tree(node['children'], indent + "  ")
+    for node, _, depth in iter_preorder(element_tree):
+        print(f"{indent}{'  ' * depth}{node['id']}: {node['properties']}")
 
 # Main execution
 input_folder = 'inputs'